@@ -1,22 +1,30 @@
 #!/usr/bin/python3
 import argparse
+import copy
 import datetime as dt
+import functools
+import hashlib
 import html
+import inspect
 import json
 import os
+import re
 import sys
 import subprocess
 import time
 import logging
 from collections import namedtuple
 import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from urllib.parse import urljoin
 
 LOGFILE = 'story_checker.log'
 HISTORY_FILE = 'story_checker_history.json'
+FINGERPRINTS_FILE = 'story_checker_fingerprints.json'
 MSMTP_ACCOUNT = 'sc-gmail'
 NOTIFY_EMAIL = None  # Receiver email
 
-Chapter = namedtuple('Chapter', ['title', 'link', 'pubdate'])
+Chapter = namedtuple('Chapter', ['title', 'link', 'pubdate', 'fingerprint'], defaults=[None])
 
 log = logging.getLogger(__name__)
 
@@ -35,6 +43,9 @@ STORIES = [
     # ('PGTE', 'https://practicalguidetoevil.wordpress.com/', 'pgte'),
     ('Pale Lights', 'https://palelights.com/table-of-contents', 'pl'),
     ('TGAB', 'https://tiraas.net/', 'tgab'),
+    # Generic getter: watch a region by selector, optionally extract title/link/date from it
+    # ('Some Blog', 'https://example.com/', {
+    #     'region': 'article.post', 'title': 'h1 a', 'href': 'h1 a@href', 'date': 'time@datetime'}),
     ('Metaworld Chronicles', 'https://www.royalroad.com/fiction/syndication/14167', 'rss'),
     ('Seaborn', 'https://www.royalroad.com/fiction/syndication/30131', 'rss'),
     ('Dungeon Crawler Carl', 'https://www.royalroad.com/fiction/syndication/29358', 'rss'),
@@ -79,8 +90,12 @@ def pparse(tree, i=1):
 GETTERS = {}
 
 
+def get_raw_data(link):
+    return subprocess.check_output(f'curl -s -k -L {link}'.split(' ')).decode()
+
+
 def get_data(link):
-    return html.unescape(subprocess.check_output(f'curl -s -k -L {link}'.split(' ')).decode())
+    return html.unescape(get_raw_data(link))
 
 
 def reg_getter(f):
@@ -181,9 +196,223 @@ def pl(link):
     return Chapter(title=name, link=link, pubdate=date)
 
 
+### GENERIC GETTER
+VOID_TAGS = frozenset('area base br col embed hr img input link meta param source track wbr'.split())
+# Start of these implicitly closes an open <p>
+BLOCK_TAGS = frozenset(
+    'address article aside blockquote div dl fieldset footer form h1 h2 h3 h4 h5 h6 header hr main nav ol p pre '
+    'section table ul'.split()
+)
+# Start of a tag implicitly closes the nearest open element of these kinds (with everything still open inside it),
+# searching no further than the container boundary
+TABLE_TAGS = frozenset('table thead tbody tfoot'.split())
+CLOSED_BY = {
+    'li': ({'li'}, frozenset({'ul', 'ol'})),
+    'dt': ({'dt', 'dd'}, frozenset({'dl'})),
+    'dd': ({'dt', 'dd'}, frozenset({'dl'})),
+    'option': ({'option'}, frozenset({'select'})),
+    'tr': ({'tr'}, TABLE_TAGS),
+    'td': ({'td', 'th'}, TABLE_TAGS | {'tr'}),
+    'th': ({'td', 'th'}, TABLE_TAGS | {'tr'}),
+}
+
+class TreeParser(HTMLParser):
+    """Lenient html -> ElementTree builder, tolerates unclosed and stray tags"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = ET.Element('document')
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS and self.stack[-1].tag == 'p':
+            self.stack.pop()
+        if tag in CLOSED_BY:
+            closes, boundary = CLOSED_BY[tag]
+            for i in range(len(self.stack) - 1, 0, -1):
+                if self.stack[i].tag in closes:
+                    del self.stack[i:]
+                    break
+                if self.stack[i].tag in boundary:
+                    break
+        el = ET.SubElement(self.stack[-1], tag, {k: v or '' for k, v in attrs})
+        if tag not in VOID_TAGS:
+            self.stack.append(el)
+
+    def handle_startendtag(self, tag, attrs):
+        ET.SubElement(self.stack[-1], tag, {k: v or '' for k, v in attrs})
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        parent = self.stack[-1]
+        if len(parent):
+            parent[-1].tail = (parent[-1].tail or '') + data
+        else:
+            parent.text = (parent.text or '') + data
+
+
+def parse_html(data):
+    parser = TreeParser()
+    parser.feed(data)
+    parser.close()
+    return parser.root
+
+
+SELECTOR_TOKEN = re.compile(r'\s*(>)\s*|\s+|([\w-]+|\*)|#([\w-]+)|\.([\w-]+)|\[([\w-]+)(?:=["\']?([^"\'\]]*)["\']?)?\]')
+
+
+@functools.lru_cache(maxsize=None)
+def compile_selector(selector):
+    """
+    Compile a simple css selector into a list of (combinator, predicate) steps.
+    Supports tag, *, #id, .class, [attr], [attr=value], descendant and '>' child combinators.
+    Tag and attribute names are case-insensitive, as html parser lowercases them.
+    """
+    steps, conds, combinator, pos = [], [], ' ', 0
+    selector = selector.strip()
+
+    def flush():
+        nonlocal conds
+        if conds:
+            steps.append((combinator, tuple(conds)))
+            conds = []
+
+    while pos < len(selector):
+        m = SELECTOR_TOKEN.match(selector, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f'Bad selector {selector!r} at {pos}')
+        pos = m.end()
+        child, tag, id_, cls, attr, value = m.groups()
+        tag = tag and tag.lower()
+        attr = attr and attr.lower()
+        if tag is None and id_ is None and cls is None and attr is None:  # combinator
+            flush()
+            combinator = '>' if child else ' '
+        elif tag is not None:
+            if tag != '*':
+                conds.append(lambda el, tag=tag: el.tag == tag)
+            else:
+                conds.append(lambda el: True)
+        elif id_ is not None:
+            conds.append(lambda el, id_=id_: el.get('id') == id_)
+        elif cls is not None:
+            conds.append(lambda el, cls=cls: cls in el.get('class', '').split())
+        elif value is None:
+            conds.append(lambda el, attr=attr: attr in el.attrib)
+        else:
+            conds.append(lambda el, attr=attr, value=value: el.get(attr) == value)
+    flush()
+    if not steps:
+        raise ValueError(f'Empty selector {selector!r}')
+    return steps
+
+
+def select(root, selector):
+    """All elements under root matching selector, in document order"""
+    order = None
+    context = [root]
+    for combinator, conds in compile_selector(selector):
+        found = []
+        if combinator == '>':
+            for el in context:
+                found.extend(c for c in el if all(cond(c) for cond in conds))
+            if len(context) > 1 and len(found) > 1:  # children of nested context elements interleave
+                if order is None:
+                    order = {id(el): i for i, el in enumerate(root.iter())}
+                found.sort(key=lambda el: order[id(el)])
+        else:
+            # context is in document order, so an element nested in an earlier one is already walked
+            walked = set()
+            for el in context:
+                if id(el) in walked:
+                    continue
+                for c in el.iter():
+                    walked.add(id(c))
+                    if c is not el and all(cond(c) for cond in conds):
+                        found.append(c)
+        context = found
+    return context
+
+
+def extract(region, spec):
+    """
+    Extract a value from region by spec 'selector' (text) or 'selector@attr' (attribute).
+    Empty selector refers to the region itself.
+    """
+    selector, _, attr = spec.partition('@')
+    if selector.strip():
+        found = select(region, selector)
+        if not found:
+            raise ValueError(f'Nothing matches {selector!r}')
+        el = found[0]
+    else:
+        el = region
+    attr = attr.strip().lower()
+    if attr:
+        if attr not in el.attrib:
+            raise ValueError(f'No attribute {attr!r} on {selector!r}')
+        return el.attrib[attr]
+    return ' '.join(''.join(el.itertext()).split())
+
+
+def fingerprint_of(region):
+    # tail is the text after the closing tag, i.e. outside of the region
+    region = copy.copy(region)
+    region.tail = None
+    return hashlib.blake2b(ET.tostring(region, encoding='unicode').encode(), digest_size=8).hexdigest()
+
+
+def generic(link, region, title=None, href=None, date=None, date_fmt='%Y-%m-%dT%H:%M:%S%z', fingerprint=None):
+    """
+    Watch the first element matching `region` selector. If its fingerprint equals the previous one,
+    nothing else is extracted and pubdate is None. Without `date` the time of change is used as pubdate.
+    """
+    root = parse_html(get_raw_data(link))
+    found = select(root, region)
+    if not found:
+        return None
+    reg = found[0]
+    fp = fingerprint_of(reg)
+    if fp == fingerprint:
+        return Chapter(title=None, link=link, pubdate=None, fingerprint=fp)
+    return Chapter(
+        title=extract(reg, title) if title else 'Update',
+        link=urljoin(link, extract(reg, href)) if href else link,
+        pubdate=dt.datetime.strptime(extract(reg, date), date_fmt).timestamp() if date else time.time(),
+        fingerprint=fp,
+    )
+
+
+def make_generic(spec):
+    """Fail early on a bad spec, otherwise it only surfaces as an alert on every check"""
+    allowed = set(inspect.signature(generic).parameters) - {'link', 'fingerprint'}
+    unknown = set(spec) - allowed
+    if unknown:
+        raise ValueError(f'Unknown generic getter keys {sorted(unknown)}, allowed: {sorted(allowed)}')
+    if 'region' not in spec:
+        raise ValueError('Generic getter needs a region selector')
+    compile_selector(spec['region'])
+    for key in ('title', 'href', 'date'):
+        if spec.get(key):
+            selector = spec[key].partition('@')[0]
+            if selector.strip():
+                compile_selector(selector)
+    getter = functools.partial(generic, **spec)
+    getter.fingerprinted = True
+    return getter
+
+
 def assign_getters(r):
-    story, link, getter_name = r
-    getter = GETTERS[getter_name]
+    story, link, getter_spec = r
+    if isinstance(getter_spec, dict):
+        getter = make_generic(getter_spec)
+    else:
+        getter = GETTERS[getter_spec]
     return (story, link, getter)
 
 
@@ -192,19 +421,27 @@ class Checker:
         self.dry_run = dry_run
         self.update_history = update_history
         self.history_file = os.path.expanduser(HISTORY_FILE)
+        self.fingerprints_file = os.path.expanduser(FINGERPRINTS_FILE)
         self.history = self.get_history()
+        self.fingerprints = self.load_json(self.fingerprints_file)
 
-    def get_history(self):
-        if not os.path.exists(self.history_file):
+    @staticmethod
+    def load_json(path):
+        if not os.path.exists(path):
             return {}
-        with open(self.history_file, 'r') as inp:
+        with open(path, 'r') as inp:
             return json.loads(inp.read())
 
+    def get_history(self):
+        return self.load_json(self.history_file)
+
     def save_history(self):
         if not self.update_history:
             return
         with open(self.history_file, 'w') as out:
             out.write(json.dumps(self.history))
+        with open(self.fingerprints_file, 'w') as out:
+            out.write(json.dumps(self.fingerprints))
 
     def send_email(self, address, subject, content) -> bool:
         if self.dry_run:
@@ -232,8 +469,9 @@ class Checker:
         return self.send_email(address, subject, content)
 
     def check_story(self, name, link, getter):
+        kwargs = {'fingerprint': self.fingerprints.get(name)} if getattr(getter, 'fingerprinted', False) else {}
         try:
-            chapter = getter(link)
+            chapter = getter(link, **kwargs)
         except Exception:
             chapter = None
             log.exception(f'Failed to get {name}')
@@ -242,6 +480,10 @@ class Checker:
             self.send_email(NOTIFY_EMAIL, 'Alert', f'Failed to check {name}')
             return
 
+        if chapter.pubdate is None:
+            log.info(f'\t(unchanged) - {name}')
+            return
+
         last_ts = self.history.get(name, 0)
         is_new = last_ts < chapter.pubdate
         new_pfx = '--> ' if is_new else ''
@@ -251,6 +493,8 @@ class Checker:
             sent = self.send_notification(NOTIFY_EMAIL, name, chapter)
             if sent:
                 self.history.update({name: chapter.pubdate})
+        if chapter.fingerprint is not None and (not is_new or sent):
+            self.fingerprints.update({name: chapter.fingerprint})
 
     def check_stories(self, stories):
         for story, link, getter in stories:
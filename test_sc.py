@@ -0,0 +1,154 @@
+import pytest
+
+import sc
+
+PAGE = '''<html><body>
+<p>intro<br>unclosed
+<article class="post"><header>
+  <h1 class="entry-title"><a href="/c2">Chapter 2</a></h1>
+  <time datetime="2024-01-02T03:04:05+00:00">Jan 2</time>
+</header></article>
+<article class="post"><h1><a href="/c1">Chapter 1</a></h1></article>
+<ul><li>one<li>two<ul><li>a<li>b</ul><li>three</ul>
+</body></html>'''
+
+
+def texts(elements):
+    return [sc.extract(el, '') for el in elements]
+
+
+def test_parse_html_implicit_close():
+    root = sc.parse_html(PAGE)
+    assert len(sc.select(root, 'body > article')) == 2
+    assert texts(sc.select(root, 'body > ul > li')) == ['one', 'twoab', 'three']
+    assert texts(sc.select(root, 'ul ul > li')) == ['a', 'b']
+
+    root = sc.parse_html('<table><tr><td>a<td>b<tr><th>c<td><span>d</table>')
+    assert texts(sc.select(root, 'table > tr')) == ['ab', 'cd']
+    assert texts(sc.select(root, 'tr > *')) == ['a', 'b', 'c', 'd']
+    root = sc.parse_html('<dl><dt>t<dd><p>d<dt>u</dl><select><option>x<option><b>y</select>')
+    assert texts(sc.select(root, 'dl > *')) == ['t', 'd', 'u']
+    assert texts(sc.select(root, 'select > option')) == ['x', 'y']
+
+
+def test_select():
+    root = sc.parse_html(PAGE)
+    assert texts(sc.select(root, 'article.post h1 a')) == ['Chapter 2', 'Chapter 1']
+    assert texts(sc.select(root, 'ARTICLE > H1')) == ['Chapter 1']
+    assert texts(sc.select(root, '[HREF="/c1"]')) == ['Chapter 1']
+    assert sc.select(root, '#nope') == []
+    with pytest.raises(ValueError):
+        sc.compile_selector('a:not(b)')
+
+
+def test_select_nested_descendants():
+    root = sc.parse_html('<div>' * 50 + '<a>x</a>' + '</div>' * 50)
+    assert len(sc.select(root, 'div a')) == 1
+    assert len(sc.select(root, 'div div')) == 49
+    root = sc.parse_html('<div class=a><p>1</p><div class=a><p>2</p></div><p>3</p></div>')
+    assert texts(sc.select(root, '.a > p')) == ['1', '2', '3']
+
+
+def test_extract():
+    article = sc.select(sc.parse_html(PAGE), 'article')[0]
+    assert sc.extract(article, 'h1') == 'Chapter 2'
+    assert sc.extract(article, 'h1 a@href') == '/c2'
+    assert sc.extract(article, '@class') == 'post'
+    assert sc.extract(article, 'h1 a@HREF') == '/c2'
+    with pytest.raises(ValueError):
+        sc.extract(article, 'table')
+    with pytest.raises(ValueError, match="'title'"):
+        sc.extract(article, 'h1 a@title')
+
+
+def test_fingerprint():
+    def fp(data):
+        return sc.fingerprint_of(sc.select(sc.parse_html(data), 'p.r')[0])
+
+    assert fp('<div><p class=r>x</p>tail A</div>') == fp('<div><p class=r>x</p>tail B</div>')
+    assert fp('<div><p class=r>x</p></div>') != fp('<div><p class=r>y</p></div>')
+
+
+@pytest.fixture
+def page(monkeypatch):
+    data = {'page': PAGE}
+    monkeypatch.setattr(sc, 'get_raw_data', lambda link: data['page'])
+    return data
+
+
+def test_generic(page):
+    getter = sc.make_generic({
+        'region': 'article.post', 'title': 'h1 a', 'href': 'h1 a@href', 'date': 'time@datetime'
+    })
+    chapter = getter('https://example.com/toc/')
+    assert chapter.title == 'Chapter 2'
+    assert chapter.link == 'https://example.com/c2'
+    assert chapter.pubdate == 1704164645.0
+
+    unchanged = getter('https://example.com/toc/', fingerprint=chapter.fingerprint)
+    assert unchanged.pubdate is None
+    assert unchanged.fingerprint == chapter.fingerprint
+
+    assert sc.make_generic({'region': 'table'})('https://example.com/') is None
+
+
+@pytest.mark.parametrize('spec', [
+    {'region': 'article', 'dates': 'time'},
+    {'region': 'article', 'fingerprint': 'abc'},
+    {'title': 'h1'},
+    {'region': 'article:first'},
+    {'region': 'article', 'href': 'a[href@href'},
+])
+def test_make_generic_bad_spec(spec):
+    with pytest.raises(ValueError):
+        sc.make_generic(spec)
+    with pytest.raises(ValueError):
+        sc.assign_getters(('S', 'https://example.com/', spec))
+
+
+@pytest.fixture
+def checker(monkeypatch, tmp_path):
+    monkeypatch.setattr(sc, 'HISTORY_FILE', str(tmp_path / 'history.json'))
+    monkeypatch.setattr(sc, 'FINGERPRINTS_FILE', str(tmp_path / 'fingerprints.json'))
+    sent = []
+    c = sc.Checker(dry_run=True)
+    monkeypatch.setattr(c, 'send_notification', lambda address, name, chapter: sent.append(chapter) or True)
+    c.sent = sent
+    return c
+
+
+def test_check_story_fingerprint(page, checker, monkeypatch):
+    getter = sc.make_generic({'region': 'article.post > header', 'title': 'h1', 'date': 'time@datetime'})
+    checker.check_story('S', 'https://example.com/', getter)
+    assert [ch.title for ch in checker.sent] == ['Chapter 2']
+    assert checker.history == {'S': 1704164645.0}
+    checker.save_history()
+
+    checker = sc.Checker(dry_run=True)
+    assert checker.fingerprints == {'S': sc.fingerprint_of(sc.select(sc.parse_html(PAGE), 'header')[0])}
+
+    def no_extract(region, spec):
+        raise AssertionError('extracted unchanged region')
+
+    def no_alert(address, subject, content):
+        raise AssertionError(f'unexpected alert: {content}')
+
+    monkeypatch.setattr(sc, 'extract', no_extract)
+    monkeypatch.setattr(checker, 'send_email', no_alert)
+    checker.check_story('S', 'https://example.com/', getter)
+    assert checker.history == {'S': 1704164645.0}
+
+
+def test_check_story_unchanged_skips(page, checker):
+    getter = sc.make_generic({'region': 'article.post', 'title': 'h1'})
+    checker.check_story('S', 'https://example.com/', getter)
+    page['page'] = PAGE.replace('unclosed', 'changed outside')
+    checker.check_story('S', 'https://example.com/', getter)
+    assert len(checker.sent) == 1
+
+
+def test_check_story_failed_send_keeps_fingerprint(page, checker, monkeypatch):
+    monkeypatch.setattr(checker, 'send_notification', lambda address, name, chapter: False)
+    checker.check_story('S', 'https://example.com/', sc.make_generic({'region': 'article'}))
+    assert checker.fingerprints == {}
+    assert checker.history == {}